@@ -1,25 +1,97 @@
 #!/usr/bin/env python3
 import shlex
 import argparse
+import asyncio
+import atexit
 import subprocess
 import sys
 import getpass
 import os
 import shutil
+import stat
 import platform # --- ADDED ---
+import concurrent.futures
+import ctypes
+import ctypes.util
+import functools
+import re
+import tempfile
+import time
+import urllib.request
 
 # --- Configuration ---
 # --- MODIFIED ---: Base mirror URL, architecture will be appended.
 VOID_MIRROR_BASE = "https://repo-default.voidlinux.org/current"
-BASE_PKGS = "base-system xorg NetworkManager elogind"
-DESKTOP_ENVIRONMENTS = {
-    "xfce": "xfce4 xfce4-terminal lightdm lightdm-gtk3-greeter gvfs thunar-volman thunar-archive-plugin xfce4-pulseaudio-plugin network-manager-applet",
-    "gnome": "gnome gdm gnome-tweaks gnome-software gvfs network-manager-applet network-manager gnome-shell gnome-terminal",
-    "kde": "kde5 sddm konsole plasma-workspace plasma-desktop kdeplasma-addons kde-cli-tools kde-gtk-config kdeconnect dolphin konsole ark sddm-kcm gvfs network-manager-applet",
-    "none": ""
+BASE_PKGS = ("base-system", "xorg", "NetworkManager", "elogind", "sudo") # sudo backs the wheel sudoers drop-in
+# (name, packages, display manager service) per desktop, in menu order
+DE_TABLE = (
+    ("xfce", ("xfce4", "xfce4-terminal", "lightdm", "lightdm-gtk3-greeter", "gvfs", "thunar-volman",
+              "thunar-archive-plugin", "xfce4-pulseaudio-plugin", "network-manager-applet"), "lightdm"),
+    ("gnome", ("gnome", "gdm", "gnome-tweaks", "gnome-software", "gvfs", "network-manager-applet",
+               "gnome-shell", "gnome-terminal"), "gdm"),
+    ("kde", ("kde5", "sddm", "konsole", "plasma-workspace", "plasma-desktop", "kdeplasma-addons", "kde-cli-tools",
+             "kde-gtk-config", "kdeconnect", "dolphin", "ark", "sddm-kcm", "gvfs", "network-manager-applet"), "sddm"),
+    ("none", (), None),
+)
+DE_NAMES = tuple(name for name, _, _ in DE_TABLE)
+SOUND_PKGS = ("alsa-utils", "pipewire", "wireplumber", "sof-firmware", "alsa-pipewire")
+# Services enabled on every install (both come from BASE_PKGS)
+BASE_SERVICES = ("dbus", "NetworkManager")
+# Host packages and the commands from each that this installer actually runs
+REQUIRED_DEPS = {
+    'util-linux': ('blkid', 'cfdisk', 'sfdisk', 'mkswap', 'swapon', 'swapoff'),
+    'e2fsprogs': ('mkfs.ext4',),
+    'dosfstools': ('mkfs.vfat',),
+    'xbps': ('xbps-install',),
 }
+# mount(2) and umount2(2) flags
+MS_BIND = 0x1000
+MS_REC = 0x4000
+MS_SLAVE = 0x80000
+MNT_FORCE = 0x1
+MNT_DETACH = 0x2
+# Host package cache, shared by the dependency install, the prefetch and the
+# target install so a package is only ever downloaded once. On the live ISO it lives
+# in RAM, so it is only used for the target when enough memory is free; otherwise the
+# target's own cache on disk is used and nothing is prefetched.
+XBPS_CACHE_DIR = "/var/cache/xbps"
+TARGET_CACHE_DIR = "/mnt/var/cache/xbps"
+RAM_CACHE_MIN_FREE = 2 << 30 # bytes
+XBPS_PREFETCH_ROOT = "/tmp/xbps-prefetch"
+# Written after the prefetch fetches its index; the root survives between attempts, the target does not
+PREFETCH_SYNC_MARKER = f"{XBPS_PREFETCH_ROOT}/.voidinstall-synced"
+# Extra mkfs options per filesystem. For ext*, xfs and btrfs the force flags (-F/-f) stop
+# mkfs from asking about an old signature, which it cannot do while running in parallel
+# without a terminal; mkfs.vfat never asks, and -F32 only selects FAT32. ext4 defers
+# inode table and journal zeroing to the kernel's ext4lazyinit thread after first mount,
+# so formatting a large root takes seconds instead of minutes.
+MKFS_OPTS = {
+    "ext4": ("-F", "-E", "lazy_itable_init=1,lazy_journal_init=1"),
+    "ext3": ("-F",),
+    "ext2": ("-F",),
+    "vfat": ("-F32",),
+    "xfs": ("-f",),
+    "btrfs": ("-f",),
+}
+# mkfs.<name> helpers whose filesystem the kernel mounts under another type name
+MOUNT_FSTYPES = {"fat": "vfat", "msdos": "vfat"}
+# Filesystems that check themselves on mount; their fsck helpers are no-ops, so fstab gets pass 0
+NO_FSCK_FSTYPES = ("xfs", "btrfs")
+# Accepted answers for free-form prompts, checked before anything touches the disk
+SWAP_SIZE_RE = re.compile(r"[1-9]\d*[KMGT]")
+DEVICE_RE = re.compile(r"/dev/[\w/.-]+")
+FSTYPE_RE = re.compile(r"[a-z0-9]+")
+# "name CHARSET" entries in libc-locales, commented out or not (e.g. "#en_US.UTF-8 UTF-8"), skipping prose comments
+LOCALE_ENTRY_RE = re.compile(r"^#?[ \t]*([^#\s]\S*)[ \t]+[A-Z0-9][A-Z0-9-]*[ \t]*$", re.MULTILINE)
+LIBC_LOCALES = "/mnt/etc/default/libc-locales"
+# DMI system vendors of the hypervisors we know, matched in one pass
+VM_VENDOR_RE = re.compile(r"qemu|virtualbox|vmware|bochs|hyper-v|microsoft|xen|innotek", re.IGNORECASE)
+# PCI vendor IDs of the GPU makers we ship drivers for
+PCI_GPU_VENDORS = {"0x10de": "nvidia", "0x1002": "amd", "0x8086": "intel"}
 # --- Global variable for architecture --- ADDED ---
 ARCH = ""
+# Main repository for ARCH, set once in main() right after ARCH
+REPO_URL = ""
 
 # --- ANSI Color/Style Codes ---
 class Style:
@@ -33,47 +105,103 @@ class Style:
     BOLD = '\033[1m'
     UNDERLINE = '\033[4m'
 
+# Plain output when piped to a log file or when NO_COLOR is set (https://no-color.org)
+if not sys.stdout.isatty() or os.environ.get("NO_COLOR"):
+    for _code in ("HEADER", "OKBLUE", "OKCYAN", "OKGREEN", "WARNING", "FAIL", "ENDC", "BOLD", "UNDERLINE"):
+        setattr(Style, _code, "")
+
 # --- Core Functions ---
-def run_cmd(cmd, check=True, chroot=False):
-    """Executes a command in the shell, optionally within a chroot."""
+def run_cmd(cmd, check=True, chroot=False, input_data=None, quiet=False):
+    """Executes a command given as an argv list (no shell), optionally within a chroot.
+    input_data is fed to the command's stdin and never echoed, so it is safe for secrets.
+    quiet discards the command's stdout; stderr is kept so failures can still be diagnosed.
+    """
     if chroot:
-        # Sanitize command for chroot execution
-        cmd_sanitized = cmd.replace("'", "'\\''")
-        cmd = f"chroot /mnt /bin/bash -c '{cmd_sanitized}'"
-        
-    print(f"{Style.OKBLUE}[RUNNING]{Style.ENDC} {cmd}")
-    result = subprocess.run(cmd, shell=True, text=True)
+        cmd = ["chroot", "/mnt", *cmd]
 
-    if result.returncode != 0:
-        print(f"{Style.FAIL}[ERROR] Command failed with exit code {result.returncode}: {cmd}{Style.ENDC}")
+    cmd_str = shlex.join(cmd)
+    print(f"{Style.OKBLUE}[RUNNING]{Style.ENDC} {cmd_str}")
+    try:
+        returncode = subprocess.run(cmd, text=True, input=input_data,
+                                    stdout=subprocess.DEVNULL if quiet else None).returncode
+    except FileNotFoundError:
+        returncode = 127 # Same code the shell used to report for a missing command
+
+    if returncode != 0:
+        print(f"{Style.FAIL}[ERROR] Command failed with exit code {returncode}: {cmd_str}{Style.ENDC}")
+        if check:
+            print(f"{Style.WARNING}Exiting due to critical error.{Style.ENDC}")
+            sys.exit(1)
+        else:
+            print(f"{Style.WARNING}Continuing despite error (check=False).{Style.ENDC}")
+
+async def _run_all(cmds):
+    """Starts every command at once and returns their exit codes in order.
+    Each command's output is collected and printed as one block when it exits,
+    so concurrent jobs never interleave their lines on the terminal.
+    """
+    async def run_one(cmd):
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+        except FileNotFoundError:
+            return 127
+        output, _ = await proc.communicate()
+        text = output.decode(errors="replace").rstrip()
+        print(f"{Style.OKBLUE}[DONE]{Style.ENDC} {shlex.join(cmd)}" + (f"\n{text}" if text else ""))
+        return proc.returncode
+    return await asyncio.gather(*(run_one(cmd) for cmd in cmds))
+
+def run_cmds_parallel(cmds, check=True):
+    """Executes independent argv commands concurrently, with run_cmd's error handling."""
+    for cmd in cmds:
+        print(f"{Style.OKBLUE}[RUNNING]{Style.ENDC} {shlex.join(cmd)}")
+    returncodes = asyncio.run(_run_all(cmds))
+
+    failed = False
+    for cmd, returncode in zip(cmds, returncodes):
+        if returncode != 0:
+            failed = True
+            print(f"{Style.FAIL}[ERROR] Command failed with exit code {returncode}: {shlex.join(cmd)}{Style.ENDC}")
+    if failed:
         if check:
             print(f"{Style.WARNING}Exiting due to critical error.{Style.ENDC}")
             sys.exit(1)
         else:
             print(f"{Style.WARNING}Continuing despite error (check=False).{Style.ENDC}")
 
+def run_chroot_script(lines, check=True):
+    """Runs shell lines in a single `chroot /mnt sh -e` session instead of one chroot per command."""
+    for line in lines:
+        print(f"{Style.OKBLUE}[SCRIPT]{Style.ENDC} {line}")
+    run_cmd(["sh", "-e"], check=check, chroot=True, input_data="\n".join(lines) + "\n")
+
 def check_dependencies():
     """Checks for required commands and installs missing packages."""
     print(f"{Style.HEADER}{Style.BOLD}Checking dependencies...{Style.ENDC}")
     missing_deps = []
-    command_checks = {
-        'lsblk': 'util-linux', 'sgdisk': 'gptfdisk', 'partprobe': 'parted',
-        'mkfs.ext4': 'e2fsprogs', 'mkfs.vfat': 'dosfstools', 'xbps-install': 'xbps',
-        'mount': 'util-linux', 'wipefs': 'util-linux', 'lspci': 'pciutils',
-        'lsusb': 'usbutils', 'cryptsetup': 'cryptsetup'
-    }
     
-    for cmd, package in command_checks.items():
-        if not shutil.which(cmd) and package not in missing_deps:
+    # Scan each $PATH directory once instead of letting shutil.which stat them per command
+    available = set()
+    for path_dir in os.environ.get("PATH", os.defpath).split(os.pathsep):
+        try:
+            with os.scandir(path_dir or ".") as entries:
+                available.update(e.name for e in entries if e.is_file() and os.access(e.path, os.X_OK))
+        except OSError:
+            continue
+
+    for package, cmds in REQUIRED_DEPS.items():
+        missing_cmds = [cmd for cmd in cmds if cmd not in available]
+        if missing_cmds:
             missing_deps.append(package)
-            print(f"{Style.WARNING}Missing command: {cmd} (from package: {package}){Style.ENDC}")
+            print(f"{Style.WARNING}Missing command: {', '.join(missing_cmds)} (from package: {package}){Style.ENDC}")
     
     if missing_deps:
         print(f"\n{Style.FAIL}Missing dependencies: {' '.join(missing_deps)}{Style.ENDC}")
         print(f"{Style.OKCYAN}Attempting to install...{Style.ENDC}")
         try:
-            run_cmd("xbps-install -S", check=False)
-            run_cmd(f"xbps-install -y {' '.join(missing_deps)}")
+            run_cmd(["xbps-install", "-Sy", "-c", XBPS_CACHE_DIR, *missing_deps])
             print(f"{Style.OKGREEN}Successfully installed missing dependencies.{Style.ENDC}")
         except Exception as e:
             print(f"{Style.FAIL}Failed to install dependencies: {e}{Style.ENDC}")
@@ -81,62 +209,293 @@ def check_dependencies():
     else:
         print(f"{Style.OKGREEN}All required dependencies are present.{Style.ENDC}")
 
+def read_sysfs(path, default=""):
+    """Returns the stripped contents of a small sysfs attribute file."""
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+def sysfs_size(dev_dir):
+    """Returns a device's size from its sysfs directory, formatted like lsblk (e.g. 238.5G)."""
+    size = int(read_sysfs(f"{dev_dir}/size", "0")) * 512 # Always counted in 512-byte sectors
+    for unit in ("B", "K", "M", "G"):
+        if size < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}T"
+
+def list_disks():
+    """Yields (name, size, model) for each real disk, read from /sys/block."""
+    for name in sorted(os.listdir("/sys/block")):
+        if name.startswith(("loop", "ram", "sr", "zram", "fd")):
+            continue
+        dev_dir = f"/sys/block/{name}"
+        yield name, sysfs_size(dev_dir), read_sysfs(f"{dev_dir}/device/model")
+
+def list_partitions(disk):
+    """Yields (name, size) for each partition of a disk such as /dev/sda, read from sysfs."""
+    base = os.path.basename(disk)
+    disk_dir = f"/sys/block/{base}"
+    try:
+        # Partition directories are named after the disk (sda1, nvme0n1p1); checking the
+        # name first skips the attribute files and queue/, power/, holders/ without a stat
+        entries = sorted(e.name for e in os.scandir(disk_dir) if e.name.startswith(base) and e.is_dir())
+    except OSError:
+        return
+    for name in entries:
+        if os.path.exists(f"{disk_dir}/{name}/partition"):
+            yield name, sysfs_size(f"{disk_dir}/{name}")
+
+def unescape_mount_field(field):
+    """Decodes the octal escapes (e.g. \\040 for a space) the kernel uses in /proc mount tables."""
+    return re.sub(r"\\([0-7]{3})", lambda m: chr(int(m[1], 8)), field)
+
+def disk_block_names(disk):
+    """Returns the kernel names of a disk, its partitions and anything stacked on them (dm-crypt, LVM)."""
+    names = set()
+    pending = [os.path.basename(disk), *(name for name, _ in list_partitions(disk))]
+    while pending:
+        name = pending.pop()
+        if name not in names:
+            names.add(name)
+            try:
+                pending.extend(os.listdir(f"/sys/class/block/{name}/holders"))
+            except OSError:
+                pass
+    return names
+
 def unmount_all(disk):
     """Force unmounts all partitions on a specified disk."""
     print(f"{Style.WARNING}Attempting to unmount all partitions on {disk}...{Style.ENDC}")
-    
-    # Unmount everything under /mnt first, deepest paths first
-    result = subprocess.run("mount | grep '^/dev/' | grep '/mnt' | awk '{print $3}'", shell=True, capture_output=True, text=True)
-    mount_points = sorted([line for line in result.stdout.strip().split('\n') if line], key=len, reverse=True)
-    for mp in mount_points:
-        run_cmd(f"umount -lf {mp}", check=False)
+    names = disk_block_names(disk)
+    def on_disk(dev):
+        return dev.startswith("/dev/") and os.path.basename(os.path.realpath(dev)) in names
+
+    # /proc/swaps has a header line, then "<device or file> <type> ..." per active swap
+    with open("/proc/swaps") as f:
+        next(f, None)
+        swaps = {unescape_mount_field(line.split(None, 1)[0]) for line in f}
+    for swap in swaps:
+        if on_disk(swap) or swap.startswith("/mnt/"):
+            run_cmd(["swapoff", swap], check=False, quiet=True)
 
-    # Turn off any swap partitions on the target disk
-    result = subprocess.run(f"blkid -t TYPE=swap -o device {disk}*", shell=True, capture_output=True, text=True)
-    for swap_dev in result.stdout.strip().split('\n'):
-        if swap_dev:
-            run_cmd(f"swapoff {swap_dev}", check=False)
+    # Everything under /mnt plus anything else mounted from the disk, deepest paths first
+    with open("/proc/self/mounts") as f:
+        mounts = [tuple(map(unescape_mount_field, line.split(None, 2)[:2])) for line in f]
+    targets = {mp for source, mp in mounts if mp == "/mnt" or mp.startswith("/mnt/") or on_disk(source)}
+    for mp in sorted(targets, key=len, reverse=True):
+        umount_fs(mp, MNT_FORCE | MNT_DETACH) # umount -lf
 
-    run_cmd(f"umount -R /mnt", check=False)
+def mount_entry(path):
+    """Returns (source, fstype) of the mount at path from /proc/self/mountinfo, or None if nothing is."""
+    entry = None
+    with open("/proc/self/mountinfo") as f:
+        for line in f:
+            fields = line.split()
+            if unescape_mount_field(fields[4]) == path:
+                sep = fields.index("-")
+                entry = (unescape_mount_field(fields[sep + 2]), fields[sep + 1]) # The last entry is the topmost mount
+    return entry
+
+def mounted_fstype(path):
+    """Returns the filesystem type mounted at path, or None if nothing is."""
+    entry = mount_entry(path)
+    return entry[1] if entry else None
+
+def is_mounted(path):
+    """Checks /proc/self/mountinfo for an active mount at path."""
+    return mounted_fstype(path) is not None
+
+@functools.lru_cache(maxsize=1)
+def _libc():
+    """Loads the C library once for direct mount(2)/umount2(2) calls."""
+    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    # Declared prototypes make ctypes pass None as NULL and flags as a full unsigned long
+    libc.mount.argtypes = (ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_ulong, ctypes.c_void_p)
+    libc.mount.restype = ctypes.c_int
+    libc.umount2.argtypes = (ctypes.c_char_p, ctypes.c_int)
+    libc.umount2.restype = ctypes.c_int
+    return libc
+
+def mount_fs(source, target, fstype=None, flags=0, check=True):
+    """Mounts a filesystem with mount(2) directly instead of forking /bin/mount."""
+    print(f"{Style.OKBLUE}[MOUNTING]{Style.ENDC} {source or '(propagation change)'} -> {target}")
+    if _libc().mount(source.encode() if source else None, target.encode(), fstype.encode() if fstype else None, flags, None) != 0:
+        err = ctypes.get_errno()
+        print(f"{Style.FAIL}[ERROR] Mounting {source} on {target} failed: {os.strerror(err)}{Style.ENDC}")
+        if check:
+            print(f"{Style.WARNING}Exiting due to critical error.{Style.ENDC}")
+            sys.exit(1)
+
+def umount_fs(target, flags=0):
+    """Unmounts a filesystem with umount2(2); failures are reported but not fatal."""
+    print(f"{Style.OKBLUE}[UNMOUNTING]{Style.ENDC} {target}")
+    if _libc().umount2(target.encode(), flags) != 0:
+        err = ctypes.get_errno()
+        print(f"{Style.WARNING}Could not unmount {target}: {os.strerror(err)}{Style.ENDC}")
+
+# Host trees bound recursively into the chroot; sys brings efivars along on UEFI
+CHROOT_BINDS = ("/dev", "/proc", "/sys")
 
 def mount_chroot_dirs():
-    """Mounts virtual filesystems needed for chroot."""
+    """Mounts virtual filesystems needed for chroot. Binds that are already in place are left alone."""
     print(f"{Style.OKCYAN}Mounting virtual filesystems for chroot...{Style.ENDC}")
-    run_cmd("mount --bind /dev /mnt/dev")
-    run_cmd("mount --bind /dev/pts /mnt/dev/pts")
-    run_cmd("mount -t proc proc /mnt/proc")
-    run_cmd("mount -t sysfs sysfs /mnt/sys")
-    if os.path.exists("/sys/firmware/efi"):
-        run_cmd("mount --bind /sys/firmware/efi /mnt/sys/firmware/efi", check=False)
+    for source in CHROOT_BINDS:
+        target = f"/mnt{source}"
+        if is_mounted(target):
+            continue # Stacking a second rbind would double every submount
+        os.makedirs(target, exist_ok=True)
+        # mount --rbind, then --make-rslave so unmounting inside the chroot never
+        # propagates back to the host's /dev/pts, efivars and friends
+        mount_fs(source, target, flags=MS_BIND | MS_REC)
+        mount_fs(None, target, flags=MS_SLAVE | MS_REC)
 
 def umount_chroot_dirs():
     """Unmounts virtual filesystems."""
     print(f"{Style.OKCYAN}Unmounting virtual filesystems...{Style.ENDC}")
-    run_cmd("umount -R /mnt/dev", check=False)
-    run_cmd("umount -R /mnt/proc", check=False)
-    run_cmd("umount -R /mnt/sys", check=False)
+    for source in reversed(CHROOT_BINDS):
+        # A recursive bind carries submounts, so detach the whole tree at once
+        umount_fs(f"/mnt{source}", MNT_DETACH)
+
+def write_file_atomic(path, text, mode=0o644):
+    """Writes a config file via a temporary file and os.replace, so readers never see it half-written."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".voidinstall-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def fs_uuid(dev):
+    """Returns the filesystem UUID of a block device, or None if it has none."""
+    # udev already links every UUID under /dev/disk/by-uuid; only ask blkid if
+    # the link is missing (e.g. udev has not caught up with a fresh mkfs)
+    dev = os.path.realpath(dev)
+    try:
+        for entry in os.scandir("/dev/disk/by-uuid"):
+            if os.path.realpath(entry.path) == dev:
+                return entry.name
+    except OSError:
+        pass
+    result = subprocess.run(["blkid", "-s", "UUID", "-o", "value", dev], capture_output=True, text=True)
+    return result.stdout.strip() or None
+
+def write_fstab(swap_part=None):
+    """Adds the target's mounted filesystems and the swap partition set up for it to /mnt/etc/fstab by UUID.
+    Other active swap (the live system's, or on other disks) is left out, since the target doesn't own it.
+    """
+    entries = {} # mount point -> fstab line; swap is keyed by device since each gets mount point "none"
+    with open("/proc/self/mounts") as f:
+        for line in f:
+            source, mp, fstype = map(unescape_mount_field, line.split(None, 3)[:3])
+            if source.startswith("/dev/") and (mp == "/mnt" or mp.startswith("/mnt/")):
+                target = mp[len("/mnt"):] or "/"
+                fsck_pass = "0" if fstype in NO_FSCK_FSTYPES else "1" if target == "/" else "2"
+                entries[target] = (source, target, fstype, fsck_pass)
+    if swap_part:
+        entries[swap_part] = (swap_part, "none", "swap", "0")
+
+    lines = []
+    for source, target, fstype, fsck_pass in entries.values():
+        uuid = fs_uuid(source)
+        # noatime spares a metadata write on every read (it implies nodiratime)
+        options = "defaults" if fstype == "swap" else "defaults,noatime"
+        lines.append(f"{f'UUID={uuid}' if uuid else source} {target} {fstype} {options} 0 {fsck_pass}\n")
+
+    # Keep what base-files ships (e.g. the /tmp tmpfs line) in one pass,
+    # dropping any older entry for a mount point written above
+    ours = {target for _, target, fstype, _ in entries.values() if fstype != "swap"}
+    kept = []
+    try:
+        with open("/mnt/etc/fstab") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 2 and not line.lstrip().startswith("#") and (
+                        fields[1] in ours or fields[2] == "swap"):
+                    continue
+                kept.append(line)
+    except FileNotFoundError:
+        pass
+    write_file_atomic("/mnt/etc/fstab", "".join(kept + lines))
+    print(f"{Style.OKGREEN}Wrote /etc/fstab with {len(lines)} entries.{Style.ENDC}")
+
+def enable_services(names):
+    """Enables runit services in the target by linking them into the default runsvdir."""
+    # /var/service only points somewhere on a booted system, so link into runsvdir/default
+    runsvdir = "/mnt/etc/runit/runsvdir/default"
+    os.makedirs(runsvdir, exist_ok=True)
+    print(f"{Style.OKBLUE}[ENABLING]{Style.ENDC} {' '.join(names)}")
+    for name in names:
+        link = f"{runsvdir}/{name}"
+        try:
+            if os.path.lexists(link):
+                os.remove(link)
+            os.symlink(f"/etc/sv/{name}", link)
+        except OSError as e:
+            print(f"{Style.WARNING}Could not enable service {name}: {e}{Style.ENDC}")
 
 # --- Detection Functions ---
+@functools.lru_cache(maxsize=1)
 def detect_uefi():
     """Checks if the system is booted in UEFI mode."""
-    return os.path.exists('/sys/firmware/efi')
+    return os.path.isdir('/sys/firmware/efi')
 
-def detect_vm():
-    """Detects if the script is running in a virtual machine."""
+@functools.lru_cache(maxsize=1)
+def cpu_info():
+    """Returns the first processor's fields from /proc/cpuinfo without reading the rest."""
+    info = {}
     try:
         with open('/proc/cpuinfo', 'r') as f:
-            if 'hypervisor' in f.read().lower():
-                return True
-    except Exception: pass
+            for line in f:
+                if not line.strip():
+                    break # A blank line ends the first processor block
+                key, _, value = line.partition(':')
+                info[key.strip()] = value.strip()
+    except OSError: pass
+    return info
+
+def available_memory():
+    """Returns MemAvailable from /proc/meminfo in bytes, or 0 if it cannot be read."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return 0
+
+@functools.lru_cache(maxsize=1)
+def detect_vm():
+    """Detects if the script is running in a virtual machine."""
+    if 'hypervisor' in cpu_info().get('flags', '').split():
+        return True
     
-    dmi_vendors = ['qemu', 'virtualbox', 'vmware', 'bochs', 'hyper-v', 'microsoft']
+    return VM_VENDOR_RE.search(read_sysfs('/sys/class/dmi/id/sys_vendor')) is not None
+
+@functools.lru_cache(maxsize=1)
+def detect_gpu_vendors():
+    """Returns the known GPU vendors on the PCI bus, read straight from sysfs once per run."""
+    found = set()
+    pci_root = "/sys/bus/pci/devices"
     try:
-        sys_vendor = subprocess.run("cat /sys/class/dmi/id/sys_vendor", shell=True, capture_output=True, text=True).stdout.lower()
-        for vendor in dmi_vendors:
-            if vendor in sys_vendor:
-                return True
-    except Exception: pass
-    return False
+        devices = os.listdir(pci_root)
+    except OSError:
+        return frozenset() # No PCI bus, e.g. most ARM boards
+    for dev in devices:
+        pci_class = read_sysfs(f"{pci_root}/{dev}/class")
+        vendor = read_sysfs(f"{pci_root}/{dev}/vendor")
+        # PCI base class 0x03 covers VGA, 3D and other display controllers
+        if pci_class.startswith("0x03") and vendor in PCI_GPU_VENDORS:
+            found.add(PCI_GPU_VENDORS[vendor])
+    return frozenset(found)
 
 # --- ADDED ---: Detect machine architecture
 def detect_arch():
@@ -154,12 +513,14 @@ def detect_arch():
         sys.exit(1)
 
 # --- Installation Steps ---
-def select_disk():
-    """Prompts the user to select an installation disk."""
-    print(f"\n{Style.HEADER}{Style.BOLD}Available disks:{Style.ENDC}")
-    run_cmd("lsblk -d -o NAME,SIZE,MODEL")
-    disk = input("Enter the disk to install on (e.g., sda, nvme0n1): ").strip()
-    return f"/dev/{disk}"
+def select_disk(disk=None):
+    """Prompts the user to select an installation disk, unless one was given."""
+    if not disk:
+        print(f"\n{Style.HEADER}{Style.BOLD}Available disks:{Style.ENDC}")
+        for name, size, model in list_disks():
+            print(f"  {name:<12} {size:>8}  {model}")
+        disk = input("Enter the disk to install on (e.g., sda, nvme0n1): ").strip()
+    return disk if disk.startswith("/dev/") else f"/dev/{disk}"
 
 
 # Helper to build partition device names correctly (handles nvme/mmcblk/loop)
@@ -178,116 +539,307 @@ def part_path(disk, partnum):
         return f"{disk}p{partnum}"
     return f"{disk}{partnum}"
 
-def manual_partition_and_mount(disk):
-    """Guides user through manual partitioning and mounting."""
+def auto_partition_disk(disk, uefi, swap_size=None):
+    """Writes the automatic GPT layout and returns its (efi, root, swap) partition paths."""
+    # Wipe old signatures and write the whole layout in a single sfdisk run;
+    # sfdisk asks the kernel to re-read the table itself, so no partprobe is needed
+    layout = ["label: gpt"]
+    if uefi:
+        layout.append("size=512MiB, type=uefi") # EFI (512M)
+    else: # BIOS / Legacy (relevant for x86_64, but generic for partitioning)
+        layout.append("size=1MiB, type=21686148-6449-6E6F-744E-656564454649") # BIOS Boot (1M)
+    if swap_size:
+        layout.append(f"size={swap_size}, type=swap") # SWAP (optional)
+        swap_part, root_num = part_path(disk, 2), 3
+    else:
+        swap_part, root_num = None, 2
+    layout.append("type=linux") # ROOT (rest)
+    for line in layout:
+        print(f"{Style.OKBLUE}[LAYOUT]{Style.ENDC} {line}")
+    run_cmd(["sfdisk", "--wipe", "always", "--wipe-partitions", "always", disk], input_data="\n".join(layout) + "\n")
+    # Wait once for udev to create the new partition nodes before anything formats them
+    run_cmd(["udevadm", "settle", "--timeout=10"], check=False)
+
+    efi_part = part_path(disk, 1) if uefi else None
+    return efi_part, part_path(disk, root_num), swap_part
+
+def mkfs_cmd(fstype, part):
+    """Returns the argv that formats part as fstype, with the options from MKFS_OPTS."""
+    return [f"mkfs.{fstype}", *MKFS_OPTS.get(fstype, ()), part]
+
+def format_auto_partitions(root_part, efi_part=None, swap_part=None):
+    """Formats the auto-created partitions concurrently, then enables swap and mounts them."""
+    # Each job targets a different partition, so they can all run at once
+    jobs = [mkfs_cmd("ext4", root_part)]
+    if efi_part:
+        jobs.append(mkfs_cmd("vfat", efi_part))
+    if swap_part:
+        jobs.append(["mkswap", swap_part])
+    run_cmds_parallel(jobs)
+
+    # Mounting depends on the formats above and on each other, so it stays serial
+    if swap_part:
+        run_cmd(["swapon", swap_part], quiet=True)
+    mount_fs(root_part, "/mnt", "ext4")
+    if efi_part:
+        os.makedirs("/mnt/boot/efi", exist_ok=True)
+        mount_fs(efi_part, "/mnt/boot/efi", "vfat")
+
+def prompt_valid(prompt, is_valid, error):
+    """Repeats an input() prompt until is_valid accepts the stripped answer."""
+    while True:
+        answer = input(prompt).strip()
+        if is_valid(answer):
+            return answer
+        print(f"{Style.FAIL}{error}{Style.ENDC}")
+
+def prompt_device(prompt, disk, used=()):
+    """Asks for a partition of disk, given as a /dev path, that is not one of the used devices.
+    Everything is checked up front, since a bad answer would otherwise only surface after
+    the other partitions have already been formatted.
+    """
+    partitions = {name for name, _ in list_partitions(disk)}
+    taken = {os.path.realpath(dev) for dev in used}
+
+    def valid(dev):
+        if not DEVICE_RE.fullmatch(dev) or not os.path.exists(dev):
+            return False
+        real = os.path.realpath(dev)
+        return (stat.S_ISBLK(os.stat(real).st_mode) and os.path.basename(real) in partitions
+                and real not in taken)
+    return prompt_valid(prompt, valid, f"Enter a partition of {disk}, such as /dev/sda2, that is not already assigned.")
+
+def prompt_fstype(prompt):
+    """Asks for a filesystem type that has an mkfs helper on this host."""
+    return prompt_valid(prompt, lambda fs: FSTYPE_RE.fullmatch(fs) and shutil.which(f"mkfs.{fs}"),
+                        "Unknown filesystem; no matching mkfs.<type> command was found.")
+
+def manual_partition_and_mount(disk, uefi):
+    """Guides user through manual partitioning and mounting. Returns the swap partition, if any."""
     print(f"\n{Style.WARNING}{Style.BOLD}Manual Partitioning Mode{Style.ENDC}")
     print("You will now be placed in `cfdisk`. Please create your desired partitions.")
     print("A typical setup includes: an EFI partition (if UEFI), a root partition, and optionally swap and home.")
     input("Press Enter to launch cfdisk...")
-    run_cmd(f"cfdisk {disk}")
+    run_cmd(["cfdisk", disk])
+    run_cmd(["udevadm", "settle", "--timeout=10"], check=False)
     
     print(f"\n{Style.HEADER}{Style.BOLD}Available partitions on {disk}:{Style.ENDC}")
-    run_cmd(f"lsblk {disk}")
+    for name, size in list_partitions(disk):
+        print(f"  /dev/{name:<12} {size:>8}")
 
-    root_part = input("Enter device for root (/) (e.g., /dev/sda2): ").strip()
-    root_fs = input("Enter filesystem for root (e.g., ext4): ").strip()
-    run_cmd(f"mkfs.{root_fs} {root_part}")
-    run_cmd(f"mount {root_part} /mnt")
+    # Gather every (device, filesystem, mount point) first so the formats can run together;
+    # each device may serve only one role, or two mkfs jobs would race on it
+    root_part = prompt_device("Enter device for root (/) (e.g., /dev/sda2): ", disk)
+    root_fs = prompt_fstype("Enter filesystem for root (e.g., ext4): ")
+    mounts = [(root_part, root_fs, "/")]
 
-    if detect_uefi():
-        efi_part = input("Enter device for EFI partition (e.g., /dev/sda1): ").strip()
-        run_cmd(f"mkfs.vfat -F32 {efi_part}")
-        run_cmd("mkdir -p /mnt/boot/efi")
-        run_cmd(f"mount {efi_part} /mnt/boot/efi")
+    if uefi:
+        efi_part = prompt_device("Enter device for EFI partition (e.g., /dev/sda1): ", disk, [m[0] for m in mounts])
+        mounts.append((efi_part, "vfat", "/boot/efi"))
 
     if input("Do you have a separate /boot partition? [y/N]: ").lower() == 'y':
-        boot_part = input("Enter device for /boot (e.g., /dev/sda3): ").strip()
-        boot_fs = input("Enter filesystem for /boot (e.g., ext4): ").strip()
-        run_cmd(f"mkfs.{boot_fs} {boot_part}")
-        if not os.path.exists("/mnt/boot"): run_cmd("mkdir -p /mnt/boot")
-        run_cmd(f"mount {boot_part} /mnt/boot")
+        boot_part = prompt_device("Enter device for /boot (e.g., /dev/sda3): ", disk, [m[0] for m in mounts])
+        boot_fs = prompt_fstype("Enter filesystem for /boot (e.g., ext4): ")
+        mounts.append((boot_part, boot_fs, "/boot"))
     
+    swap_part = None
     if input("Do you have a swap partition? [y/N]: ").lower() == 'y':
-        swap_part = input("Enter device for swap (e.g., /dev/sda4): ").strip()
-        run_cmd(f"mkswap {swap_part}")
-        run_cmd(f"swapon {swap_part}")
+        swap_part = prompt_device("Enter device for swap (e.g., /dev/sda4): ", disk, [m[0] for m in mounts])
+
+    # unmount_all() has already cleared /mnt; anything still mounted there would receive
+    # the install instead of the root partition that is about to be formatted
+    mnt_entry = mount_entry("/mnt")
+    if mnt_entry:
+        print(f"{Style.FAIL}/mnt is still mounted from {mnt_entry[0]}. "
+              f"Unmount it and run the installer again.{Style.ENDC}")
+        sys.exit(1)
+
+    jobs = [mkfs_cmd(fs, part) for part, fs, _ in mounts]
+    if swap_part:
+        jobs.append(["mkswap", swap_part])
+    run_cmds_parallel(jobs)
+
+    if swap_part:
+        run_cmd(["swapon", swap_part], quiet=True)
+    # Parents before children, so /boot is mounted before /boot/efi
+    for part, fs, mnt in sorted(mounts, key=lambda m: len(m[2].rstrip("/").split("/"))):
+        target = "/mnt" + mnt.rstrip("/")
+        os.makedirs(target, exist_ok=True)
+        mount_fs(part, target, MOUNT_FSTYPES.get(fs, fs))
+    return swap_part
+
+def copy_repo_keys(rootdir):
+    """Copies the live system's trusted repository keys into rootdir.
+    Without them xbps asks before importing a key, which a run without a terminal answers with no.
+    """
+    try:
+        shutil.copytree("/var/db/xbps/keys", f"{rootdir}/var/db/xbps/keys", dirs_exist_ok=True)
+    except OSError:
+        pass # xbps will ask on the first interactive install instead
 
 # --- MODIFIED ---: Function now uses global ARCH variable
 def setup_repos():
     """Sets up main and non-free repositories on the target system."""
-    global ARCH
+    global ARCH, REPO_URL
     print(f"{Style.OKCYAN}Setting up XBPS repositories for {ARCH}...{Style.ENDC}")
-    run_cmd("mkdir -p /mnt/etc/xbps.d")
-    
-    repo_url = f"{VOID_MIRROR_BASE}/{ARCH}" if ARCH != "x86_64" else VOID_MIRROR_BASE
-    
-    with open("/mnt/etc/xbps.d/00-repository-main.conf", "w") as f:
-        f.write(f"repository={repo_url}\n")
-    with open("/mnt/etc/xbps.d/10-repository-nonfree.conf", "w") as f:
-        f.write(f"repository={repo_url}/nonfree\n")
-    
+    os.makedirs("/mnt/etc/xbps.d", exist_ok=True)
+    copy_repo_keys("/mnt")
+
+    repos = [REPO_URL, f"{REPO_URL}/nonfree"]
     # Multilib is only for x86_64
     if ARCH == "x86_64":
-        with open("/mnt/etc/xbps.d/20-repository-multilib.conf", "w") as f:
-            f.write(f"repository={repo_url}/multilib\n")
+        repos += [f"{REPO_URL}/multilib", f"{REPO_URL}/multilib/nonfree"]
 
-# --- MODIFIED ---: Function now uses global ARCH variable for repo path
-def install_base_system():
-    """Installs the Void Linux base system."""
-    global ARCH
-    repo_url = f"{VOID_MIRROR_BASE}/{ARCH}" if ARCH != "x86_64" else VOID_MIRROR_BASE
-    print(f"\n{Style.HEADER}{Style.BOLD}Installing base system from {repo_url}...{Style.ENDC}")
-    run_cmd(f"xbps-install -Sy -R {repo_url} -r /mnt {BASE_PKGS}")
+    # xbps reads every *.conf in xbps.d, so one file holds all the repositories
+    write_file_atomic("/mnt/etc/xbps.d/00-repositories.conf", "".join(f"repository={repo}\n" for repo in repos))
+
+def mark_prefetch_index_synced():
+    """Records that the prefetch root's index for REPO_URL was just fetched."""
+    global REPO_URL
+    write_file_atomic(PREFETCH_SYNC_MARKER, f"{REPO_URL}\n")
+
+def prefetch_index_fresh(max_age=300):
+    """Checks whether the prefetch root's index for REPO_URL was fetched within max_age seconds,
+    e.g. by an earlier attempt, so the -S round trip to the mirror can be skipped. The marker's
+    own mtime is used because xbps stamps each index with the server's Last-Modified time.
+    """
+    global REPO_URL
+    try:
+        with open(PREFETCH_SYNC_MARKER) as f:
+            synced = f.read().split()
+        age = time.time() - os.stat(PREFETCH_SYNC_MARKER).st_mtime
+    except OSError:
+        return False
+    return age < max_age and synced == [REPO_URL]
+
+def sync_repo_index():
+    """Fetches the target's repository index quietly so it can run in the background.
+    Returns True if the index is now up to date.
+    """
+    global REPO_URL
+    try:
+        result = subprocess.run(["xbps-install", "-Sy", "-R", REPO_URL, "-r", "/mnt"],
+                                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except OSError:
+        return False
+    return result.returncode == 0
+
+def prefetch_packages(pkgs):
+    """Starts downloading packages into XBPS_CACHE_DIR in the background.
+    Returns the running process, or None if it could not be started.
+    """
+    global REPO_URL
+    os.makedirs(XBPS_PREFETCH_ROOT, exist_ok=True)
+    copy_repo_keys(XBPS_PREFETCH_ROOT)
+    try:
+        # An empty throwaway root makes xbps resolve and fetch the full dependency closure
+        sync = "-y" if prefetch_index_fresh() else "-Sy"
+        return subprocess.Popen(["xbps-install", sync, "--download-only", "-R", REPO_URL,
+                                 "-r", XBPS_PREFETCH_ROOT, "-c", XBPS_CACHE_DIR, *pkgs],
+                                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except OSError:
+        return None
+
+def _download(url, dest):
+    """Downloads url to dest via a temporary file, so a failed transfer never leaves a partial file."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest), prefix=".voidinstall-")
+    try:
+        with os.fdopen(fd, "wb") as f, urllib.request.urlopen(url, timeout=60) as resp:
+            shutil.copyfileobj(resp, f)
+        os.replace(tmp, dest)
+        return True
+    except Exception: # Also http.client.HTTPException (e.g. IncompleteRead), which is no OSError
+        return False
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+def fetch_packages_parallel(pkgs, cache_dir=XBPS_CACHE_DIR, workers=4):
+    """Downloads the packages of the pending transaction into cache_dir over several connections.
+    xbps fetches one file at a time; anything this misses is simply fetched by xbps-install itself.
+    """
+    global REPO_URL
+    # A dry run lists the whole transaction as "pkgver action arch repository ..." lines
+    result = subprocess.run(["xbps-install", "-n", "-R", REPO_URL, "-r", "/mnt", "-c", cache_dir, *pkgs],
+                            stdin=subprocess.DEVNULL, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"{Style.WARNING}Could not resolve the package transaction (xbps-install -n exited with "
+              f"{result.returncode}); xbps-install will download everything itself.{Style.ENDC}")
+        return
+    jobs = []
+    for line in result.stdout.splitlines():
+        fields = line.split()
+        if len(fields) < 4 or fields[1] not in ("install", "update"):
+            continue
+        pkgver, _, arch, repo = fields[:4]
+        filename = f"{pkgver}.{arch}.xbps"
+        if not os.path.exists(f"{cache_dir}/{filename}"):
+            jobs.append((f"{repo}/{filename}", f"{cache_dir}/{filename}"))
+    if not jobs:
+        return
+
+    def fetch(job):
+        url, dest = job
+        # xbps only trusts a cached package next to its signature, so fetch the pair
+        if not _download(f"{url}.sig2", f"{dest}.sig2"):
+            return False
+        if _download(url, dest):
+            return True
+        os.remove(f"{dest}.sig2")
+        return False
+
+    print(f"{Style.OKCYAN}Downloading {len(jobs)} packages over {workers} connections...{Style.ENDC}")
+    os.makedirs(cache_dir, exist_ok=True)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        fetched = sum(pool.map(fetch, jobs))
+    if fetched < len(jobs):
+        print(f"{Style.WARNING}{len(jobs) - fetched} packages will be downloaded by xbps-install instead.{Style.ENDC}")
+
+def install_packages(pkgs, sync=True, cache_dir=XBPS_CACHE_DIR):
+    """Installs all collected packages into /mnt in a single xbps transaction."""
+    global REPO_URL
+    pkgs = list(dict.fromkeys(pkgs))  # deduplicate while preserving order
+    print(f"\n{Style.HEADER}{Style.BOLD}Installing {len(pkgs)} packages from {REPO_URL}...{Style.ENDC}")
+    run_cmd(["xbps-install", "-Sy" if sync else "-y", "-R", REPO_URL, "-r", "/mnt", "-c", cache_dir, *pkgs])
+
+def select_desktop(de_name=None):
+    """Prompts for a desktop environment (unless de_name is given) and returns its DE_TABLE entry and the packages to install."""
+    if de_name:
+        de_entry = DE_TABLE[DE_NAMES.index(de_name)]
+        return de_entry, [*de_entry[1], *SOUND_PKGS]
 
-def install_desktop_and_sound():
-    """Installs a desktop environment and sound packages."""
     print(f"\n{Style.HEADER}{Style.BOLD}Desktop Environment Selection:{Style.ENDC}")
-    for i, de in enumerate(DESKTOP_ENVIRONMENTS.keys()):
-        print(f"  {i+1}. {de}")
+    for i, name in enumerate(DE_NAMES):
+        print(f"  {i+1}. {name}")
     choice_str = input("Select a desktop [number, default 'none']: ").strip()
     
     try:
         choice_idx = int(choice_str) - 1
-        de_key = list(DESKTOP_ENVIRONMENTS.keys())[choice_idx]
-    except (ValueError, IndexError):
-        de_key = "none"
+    except ValueError:
+        choice_idx = -1
+    if not 0 <= choice_idx < len(DE_TABLE):
+        choice_idx = len(DE_TABLE) - 1
 
-    de_pkgs = DESKTOP_ENVIRONMENTS[de_key]
-    sound_pkgs = "alsa-utils pipewire wireplumber sof-firmware alsa-pipewire"
-    
+    de_entry = DE_TABLE[choice_idx]
+    name, de_pkgs, _ = de_entry
     if de_pkgs:
-        print(f"{Style.OKCYAN}Installing {de_key} desktop and sound packages...{Style.ENDC}")
-        run_cmd(f"xbps-install -Sy -r /mnt {de_pkgs} {sound_pkgs}")
+        print(f"{Style.OKCYAN}Selected {name} desktop with sound packages.{Style.ENDC}")
     else:
-        print(f"{Style.OKCYAN}Installing sound packages only...{Style.ENDC}")
-        run_cmd(f"xbps-install -Sy -r /mnt {sound_pkgs}")
+        print(f"{Style.OKCYAN}No desktop selected; sound packages only.{Style.ENDC}")
+    return de_entry, [*de_pkgs, *SOUND_PKGS]
 
 
-def detect_and_install_graphics(is_vm=False):
-    """Detect graphics hardware and install appropriate drivers into the target (/mnt).
+def detect_graphics_packages(is_vm=False):
+    """Detect graphics hardware and return the driver packages to install into the target (/mnt).
     Skips heavy/proprietary installs when running inside virtual machines unless forced.
     """
     print(f"\n{Style.HEADER}{Style.BOLD}Detecting graphics hardware...{Style.ENDC}")
 
-    try:
-        result = subprocess.run("lspci -nnk | grep -iE 'vga|3d|display' -A2", shell=True, capture_output=True, text=True)
-        out = result.stdout.lower()
-    except Exception as e:
-        print(f"{Style.WARNING}Could not run lspci: {e}. Skipping graphics autodetection.{Style.ENDC}")
-        return
-
-    found = set()
-    if 'nvidia' in out:
-        found.add('nvidia')
-    if 'radeon' in out or 'amd' in out or 'advanced micro devices' in out:
-        found.add('amd')
-    if 'intel' in out and 'intel corporation' in out or 'intel' in out:
-        # catch many intel strings
-        found.add('intel')
+    found = detect_gpu_vendors() # Empty when there is no PCI bus to scan
 
     if not found:
         print(f"{Style.OKGREEN}No discrete graphics detected or only virtual graphics present.{Style.ENDC}")
-        return
+        return []
 
     print(f"{Style.OKCYAN}Detected graphics adapters: {', '.join(found)}{Style.ENDC}")
 
@@ -295,7 +847,7 @@ def detect_and_install_graphics(is_vm=False):
     if is_vm:
         print(f"{Style.WARNING}Running in a VM - skipping proprietary or host-specific graphics driver installation by default.{Style.ENDC}")
         print(f"If you want drivers installed anyway, re-run with --force-removable or install manually inside the target after first boot.{Style.ENDC}")
-        return
+        return []
 
     pkgs = []
     # NVIDIA
@@ -316,63 +868,129 @@ def detect_and_install_graphics(is_vm=False):
 
     if not pkgs:
         print(f"{Style.WARNING}No driver packages to install after detection.{Style.ENDC}")
-        return
+        return []
 
     pkgs = list(dict.fromkeys(pkgs))  # deduplicate while preserving order
-    pkg_str = ' '.join(pkgs)
-    print(f"{Style.OKCYAN}Installing graphics packages into target: {pkg_str}{Style.ENDC}")
-    run_cmd(f"xbps-install -Sy -r /mnt {pkg_str}")
-    print(f"{Style.OKGREEN}Graphics drivers installation requested. Reconfigure and test after first boot.{Style.ENDC}")
+    print(f"{Style.OKCYAN}Graphics packages queued for install: {' '.join(pkgs)}{Style.ENDC}")
+    return pkgs
 
-def chroot_and_configure():
-    """Performs system configuration inside the chroot."""
-    print(f"\n{Style.HEADER}{Style.BOLD}Configuring the new system...{Style.ENDC}")
-    run_cmd("cp /etc/resolv.conf /mnt/etc/resolv.conf")
+def microcode_packages(is_vm=False):
+    """Returns the CPU microcode package to install, chosen from the first cpuinfo vendor_id.
+    AMD microcode already ships in linux-firmware-amd, which base-system pulls in.
+    """
+    if is_vm or ARCH != "x86_64":
+        return []
+    if cpu_info().get('vendor_id') == 'GenuineIntel':
+        print(f"{Style.OKCYAN}Intel CPU detected; adding intel-ucode (nonfree).{Style.ENDC}")
+        return ["intel-ucode"]
+    return []
 
-    print(f"{Style.OKCYAN}Set the root password:{Style.ENDC}")
-    run_cmd("passwd", chroot=True)
+def read_password_file(path):
+    """Reads chpasswd-style "name:password" lines into a dict; blank lines and # comments are skipped."""
+    passwords = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if line.strip() and not line.lstrip().startswith("#"):
+                    name, sep, password = line.partition(":")
+                    if sep and name:
+                        passwords[name] = password
+    except OSError as e:
+        print(f"{Style.FAIL}Could not read password file {path}: {e}{Style.ENDC}")
+        sys.exit(1)
+    return passwords
 
-    tz = input("Enter your timezone (e.g., America/New_York): ").strip()
-    run_cmd(f"ln -sf /usr/share/zoneinfo/{tz} /etc/localtime", chroot=True)
-    run_cmd("hwclock --systohc", chroot=True)
+def shipped_locales():
+    """Returns the locale names listed in the target's libc-locales, or an empty set if it is missing."""
+    try:
+        with open(LIBC_LOCALES) as f:
+            return set(LOCALE_ENTRY_RE.findall(f.read()))
+    except FileNotFoundError:
+        return set()
 
-    locale = input("Enter desired locale (e.g., en_US.UTF-8): ").strip()
-    run_cmd(f"echo '{locale} UTF-8' > /etc/default/libc-locales", chroot=True)
-    run_cmd("xbps-reconfigure -f glibc-locales", chroot=True)
+def enable_locale(locale):
+    """Uncomments a locale from shipped_locales() in libc-locales, keeping the rest of the list intact."""
+    with open(LIBC_LOCALES) as f:
+        text = f.read()
+    text = re.sub(rf"^#[ \t]*({re.escape(locale)}[ \t])", r"\1", text, flags=re.MULTILINE)
+    write_file_atomic(LIBC_LOCALES, text)
 
-    hostname = input("Enter a hostname for this computer: ").strip()
-    run_cmd(f"echo '{hostname}' > /etc/hostname", chroot=True)
+def chroot_and_configure(de_entry, answers):
+    """Performs system configuration inside the chroot, prompting for anything answers leaves unset."""
+    print(f"\n{Style.HEADER}{Style.BOLD}Configuring the new system...{Style.ENDC}")
+    # Give the chroot working DNS; a symlink left in the target would point into the host's /run
+    if os.path.islink("/mnt/etc/resolv.conf"):
+        os.remove("/mnt/etc/resolv.conf")
+    shutil.copyfile("/etc/resolv.conf", "/mnt/etc/resolv.conf")
 
-    # !! CRITICAL FIX !!
-    # Reconfigure all packages to run post-install hooks, essential for the kernel and grub.
-    print(f"\n{Style.OKCYAN}Finalizing package configuration (this may take a moment)...{Style.ENDC}")
-    run_cmd("xbps-reconfigure -fa", chroot=True)
+    passwords = read_password_file(answers.password_file) if answers.password_file else {}
+    if "root" not in passwords:
+        print(f"{Style.OKCYAN}Set the root password:{Style.ENDC}")
+        run_cmd(["passwd"], chroot=True)
+
+    def valid_tz(tz):
+        return bool(tz) and os.path.isfile(f"/mnt/usr/share/zoneinfo/{tz}")
+    tz = answers.timezone
+    if not valid_tz(tz):
+        tz = prompt_valid("Enter your timezone (e.g., America/New_York): ", valid_tz,
+                          "Unknown timezone; use a name from /usr/share/zoneinfo.")
+    if os.path.lexists("/mnt/etc/localtime"):
+        os.remove("/mnt/etc/localtime")
+    os.symlink(f"/usr/share/zoneinfo/{tz}", "/mnt/etc/localtime")
+
+    locales = shipped_locales()
+    if locales:
+        locale = answers.locale
+        if locale not in locales:
+            locale = prompt_valid("Enter desired locale (e.g., en_US.UTF-8): ", locales.__contains__,
+                                  "Unknown locale; use a name from /etc/default/libc-locales.")
+        enable_locale(locale)
+    else:
+        print(f"{Style.WARNING}No /etc/default/libc-locales in the target; skipping locale setup.{Style.ENDC}")
+
+    hostname = answers.hostname or input("Enter a hostname for this computer: ").strip()
+    write_file_atomic("/mnt/etc/hostname", f"{hostname}\n")
 
     print(f"{Style.OKCYAN}Creating a user account...{Style.ENDC}")
-    username = input("Enter a username: ").strip()
-    while True:
+    username = answers.username or input("Enter a username: ").strip()
+    while username not in passwords:
         password = getpass.getpass(f"Enter password for {username}: ")
         password_confirm = getpass.getpass("Confirm password: ")
         if password == password_confirm:
-            break
-        print(f"{Style.FAIL}Passwords do not match. Please try again.{Style.ENDC}")
-    
-    run_cmd(f"useradd -m -G wheel,audio,video -s /bin/bash {username}", chroot=True)
-    run_cmd(f"echo '{username}:{password}' | chpasswd", chroot=True)
+            passwords[username] = password
+        else:
+            print(f"{Style.FAIL}Passwords do not match. Please try again.{Style.ENDC}")
+
+    # Every answer is in, so the non-interactive steps share one chroot session.
+    # !! CRITICAL FIX !!
+    # Reconfigure all packages to run post-install hooks, essential for the kernel and grub.
+    print(f"\n{Style.OKCYAN}Finalizing package configuration (this may take a moment)...{Style.ENDC}")
+    run_chroot_script([
+        "hwclock --systohc",
+        "xbps-reconfigure -fa", # Also regenerates the locales written above (glibc-locales)
+        shlex.join(["useradd", "-m", "-G", "wheel,audio,video", "-s", "/bin/bash", username]),
+    ])
+    # Passwords go over stdin of their own process so they never appear in the script or the log
+    run_cmd(["chpasswd"], chroot=True, input_data="".join(f"{name}:{pw}\n" for name, pw in passwords.items()
+                                                                if name in ("root", username)))
 
     print(f"{Style.OKCYAN}Setting up sudo and enabling services...{Style.ENDC}")
-    run_cmd(f"echo '%wheel ALL=(ALL:ALL) ALL' > /etc/sudoers.d/wheel", chroot=True)
+    os.makedirs("/mnt/etc/sudoers.d", exist_ok=True)
+    write_file_atomic("/mnt/etc/sudoers.d/wheel", "%wheel ALL=(ALL:ALL) ALL\n", mode=0o440)
 
     # Enable essential services
-    run_cmd("ln -s /etc/sv/dbus /var/service/", chroot=True, check=False)
-    run_cmd("ln -s /etc/sv/NetworkManager /var/service/", chroot=True, check=False)
-    # Enable display manager if a DE was installed
-    if 'lightdm' in DESKTOP_ENVIRONMENTS.get(globals().get('de_key', 'none'), ''):
-        run_cmd("ln -s /etc/sv/lightdm /var/service/", chroot=True, check=False)
-    elif 'gdm' in DESKTOP_ENVIRONMENTS.get(globals().get('de_key', 'none'), ''):
-        run_cmd("ln -s /etc/sv/gdm /var/service/", chroot=True, check=False)
-    elif 'sddm' in DESKTOP_ENVIRONMENTS.get(globals().get('de_key', 'none'), ''):
-        run_cmd("ln -s /etc/sv/sddm /var/service/", chroot=True, check=False)
+    # plus the display manager if a DE was installed
+    enable_services([svc for svc in (*BASE_SERVICES, de_entry[2]) if svc])
+
+def bootloader_packages(uefi):
+    """Returns the GRUB packages needed for this architecture and boot mode."""
+    global ARCH
+    if ARCH == "x86_64":
+        return ["grub-x86_64-efi", "efibootmgr"] if uefi else ["grub"]
+    if ARCH == "aarch64" and uefi:
+        return ["grub-arm64-efi", "efibootmgr"]
+    return [] # Bootloader is set up manually on other ARM boards
 
 # --- MODIFIED ---: Major rewrite for multi-architecture support
 def install_bootloader(disk, uefi, force_removable=True, is_vm=False):
@@ -380,32 +998,38 @@ def install_bootloader(disk, uefi, force_removable=True, is_vm=False):
     global ARCH
     print(f"\n{Style.HEADER}{Style.BOLD}Installing bootloader for {ARCH}...{Style.ENDC}")
 
+    if uefi and ARCH in ("x86_64", "aarch64"):
+        efi_fstype = mounted_fstype("/mnt/boot/efi")
+        if efi_fstype is None:
+            efi_part = input("EFI partition is not mounted. Enter EFI partition (e.g., /dev/sda1): ").strip()
+            if efi_part:
+                os.makedirs("/mnt/boot/efi", exist_ok=True)
+                mount_fs(efi_part, "/mnt/boot/efi", "vfat")
+        elif efi_fstype != "vfat":
+            print(f"{Style.WARNING}/mnt/boot/efi is {efi_fstype}, not vfat; the firmware may not find the bootloader.{Style.ENDC}")
+
+    # grub-install and grub-mkconfig run as one script in a single chroot session
+    efi_install = shlex.join(["grub-install", "--target=x86_64-efi", "--efi-directory=/boot/efi", "--bootloader-id=void", "--recheck"])
+    removable_install = shlex.join(["grub-install", "--target=x86_64-efi", "--efi-directory=/boot/efi", "--removable", "--recheck"])
     if ARCH == "x86_64":
         if uefi:
             print(f"{Style.OKCYAN}UEFI system detected.{Style.ENDC}")
-            run_cmd("xbps-install -Sy grub-x86_64-efi efibootmgr", chroot=True)
             # Always use --removable for VMs to ensure bootloader works
             if is_vm or force_removable:
                 print(f"{Style.WARNING}VM detected or removable mode forced. Installing GRUB in removable mode.{Style.ENDC}")
-                # Install both ways for maximum compatibility in VMs
-                run_cmd("grub-install --target=x86_64-efi --efi-directory=/boot/efi --removable --recheck", chroot=True)
-                run_cmd("grub-install --target=x86_64-efi --efi-directory=/boot/efi --bootloader-id=void --recheck", chroot=True, check=False)
+                # Install both ways for maximum compatibility in VMs; the named entry is optional
+                script = [removable_install, f"{efi_install} || echo 'Named GRUB entry failed; removable install is in place.'"]
             else:
                 print(f"{Style.OKCYAN}Attempting standard UEFI GRUB installation...{Style.ENDC}")
-                result = subprocess.run(f"chroot /mnt /bin/bash -c 'grub-install --target=x86_64-efi --efi-directory=/boot/efi --bootloader-id=void --recheck'", shell=True)
-                if result.returncode != 0:
-                    print(f"{Style.WARNING}Standard GRUB install failed. Falling back to removable mode.{Style.ENDC}")
-                    run_cmd("grub-install --target=x86_64-efi --efi-directory=/boot/efi --removable --recheck", chroot=True)
+                script = [f"{efi_install} || {{ echo 'Standard GRUB install failed. Falling back to removable mode.'; {removable_install}; }}"]
         else:
             print(f"{Style.OKCYAN}Legacy BIOS system detected.{Style.ENDC}")
-            run_cmd("xbps-install -Sy grub", chroot=True)
-            run_cmd(f"grub-install --target=i386-pc {disk}", chroot=True)
+            script = [shlex.join(["grub-install", "--target=i386-pc", disk])]
     
     elif ARCH == "aarch64":
         if uefi:
             print(f"{Style.OKCYAN}AArch64 UEFI system detected.{Style.ENDC}")
-            run_cmd("xbps-install -Sy grub-arm64-efi efibootmgr", chroot=True)
-            run_cmd("grub-install --target=arm64-efi --efi-directory=/boot/efi --bootloader-id=Void --recheck", chroot=True)
+            script = [shlex.join(["grub-install", "--target=arm64-efi", "--efi-directory=/boot/efi", "--bootloader-id=Void", "--recheck"])]
         else:
             print(f"{Style.WARNING}Non-UEFI AArch64 systems (e.g., using U-Boot) require manual bootloader setup.{Style.ENDC}")
             print("Please consult the Void Linux documentation for your specific device after the script finishes.")
@@ -417,27 +1041,84 @@ def install_bootloader(disk, uefi, force_removable=True, is_vm=False):
         print("Please consult the Void Linux documentation for your board to set up the bootloader manually.")
         return # Skip grub-mkconfig
 
-    print(f"{Style.OKCYAN}Generating GRUB configuration...{Style.ENDC}")
     # Ensure grub2 directory exists inside chroot before generating config
-    run_cmd("mkdir -p /mnt/boot/grub2", check=False)
-    run_cmd("grub-mkconfig -o /boot/grub/grub.cfg", chroot=True)
+    os.makedirs("/mnt/boot/grub2", exist_ok=True)
+    # os-prober mounts every filesystem it finds looking for other systems; a VM has none
+    script.append(f"{'GRUB_DISABLE_OS_PROBER=true ' if is_vm else ''}grub-mkconfig -o /boot/grub/grub.cfg")
+    print(f"{Style.OKCYAN}Generating GRUB configuration...{Style.ENDC}")
+    run_chroot_script(script)
     print(f"{Style.OKGREEN}Bootloader installation step complete.{Style.ENDC}")
 
 
+def parse_args():
+    """Parses command-line options; values from --config fill in any option not given on the command line."""
+    parser = argparse.ArgumentParser(description="Void Linux Installer Script")
+    parser.add_argument('--force-removable', action='store_true', help='Force GRUB to install in removable media mode (for UEFI).')
+    parser.add_argument('--config', metavar='FILE', help='TOML file with answers for any of the options below (keys use underscores).')
+    parser.add_argument('--disk', help='Disk to install on, e.g. sda or /dev/nvme0n1.')
+    parser.add_argument('--mode', choices=('auto', 'manual'), help='Partitioning mode.')
+    parser.add_argument('--yes', action='store_true', help='Skip the confirmation before auto-partitioning erases the disk.')
+    swap = parser.add_mutually_exclusive_group()
+    swap.add_argument('--swap-size', help='Create a swap partition of this size in auto mode, e.g. 4G.')
+    swap.add_argument('--no-swap', action='store_true', help='Do not create a swap partition in auto mode.')
+    parser.add_argument('--de', choices=DE_NAMES, help='Desktop environment to install.')
+    parser.add_argument('--timezone', help='Timezone, e.g. America/New_York.')
+    parser.add_argument('--locale', help='Locale, e.g. en_US.UTF-8.')
+    parser.add_argument('--hostname', help='Hostname for the new system.')
+    parser.add_argument('--username', help='Name of the user account to create.')
+    parser.add_argument('--password-file', metavar='FILE',
+                        help='File of chpasswd-style "name:password" lines for root and/or the new user; missing ones are prompted for.')
+    parser.add_argument('--reboot', action='store_true', help='Reboot when the install finishes instead of asking.')
+    args = parser.parse_args()
+
+    if args.config:
+        try:
+            import tomllib # Python 3.11+
+        except ImportError:
+            parser.error("--config needs Python 3.11 or newer (tomllib).")
+        try:
+            with open(args.config, "rb") as f:
+                config = tomllib.load(f)
+        except (OSError, tomllib.TOMLDecodeError) as e:
+            parser.error(f"could not read {args.config}: {e}")
+        unknown = set(config) - set(vars(args))
+        if unknown:
+            parser.error(f"unknown keys in {args.config}: {', '.join(sorted(unknown))}")
+        # Flags default to False and take booleans; every other option takes a string
+        for key, value in config.items():
+            expected = bool if isinstance(getattr(args, key), bool) else str
+            if not isinstance(value, expected):
+                parser.error(f"{key} in {args.config} must be a {'boolean' if expected is bool else 'string'}")
+        # Command-line values take precedence over the file, including across the swap options
+        if args.swap_size or args.no_swap:
+            config.pop("swap_size", None)
+            config.pop("no_swap", None)
+        if config.get("swap_size") and config.get("no_swap"):
+            parser.error(f"swap_size and no_swap in {args.config} are mutually exclusive")
+        parser.set_defaults(**config)
+        args = parser.parse_args()
+
+    if args.swap_size and not SWAP_SIZE_RE.fullmatch(args.swap_size):
+        parser.error("--swap-size must be a whole number followed by K, M, G or T.")
+    if args.mode and args.mode not in ('auto', 'manual'):
+        parser.error(f"unknown partitioning mode: {args.mode}")
+    if args.de and args.de not in DE_NAMES:
+        parser.error(f"unknown desktop environment: {args.de}")
+    return args
+
 def main():
     """Main installer workflow."""
-    global ARCH # --- ADDED ---
+    global ARCH, REPO_URL # --- ADDED ---
     print(f"{Style.HEADER}{Style.BOLD}=== Void Linux Interactive Installer ==={Style.ENDC}")
     if os.geteuid() != 0:
         print(f"{Style.FAIL}This script must be run as root.{Style.ENDC}")
         sys.exit(1)
 
-    parser = argparse.ArgumentParser(description="Void Linux Installer Script")
-    parser.add_argument('--force-removable', action='store_true', help='Force GRUB to install in removable media mode (for UEFI).')
-    args = parser.parse_args()
+    args = parse_args()
 
     # --- ADDED ---: Detect and confirm architecture first
     ARCH = detect_arch()
+    REPO_URL = f"{VOID_MIRROR_BASE}/{ARCH}" if ARCH != "x86_64" else VOID_MIRROR_BASE
     print(f"{Style.OKCYAN}Detected Architecture: {Style.BOLD}{ARCH}{Style.ENDC}")
 
     check_dependencies()
@@ -447,73 +1128,81 @@ def main():
     if is_vm:
         print(f"{Style.WARNING}Virtual machine environment detected. Using safer defaults.{Style.ENDC}")
 
-    disk = select_disk()
+    # The live system's cache is in RAM; with too little free, packages go straight to the target disk
+    ram_cache = available_memory() >= RAM_CACHE_MIN_FREE
+    cache_dir = XBPS_CACHE_DIR if ram_cache else TARGET_CACHE_DIR
+    if not ram_cache:
+        print(f"{Style.WARNING}Less than {RAM_CACHE_MIN_FREE >> 30} GiB of memory free; "
+              f"packages will be downloaded to the target disk during the install.{Style.ENDC}")
+
+    # Start downloading the base system now so it overlaps disk selection and partitioning;
+    # a desktop given up front is fetched along with it
+    prefetch = None
+    if ram_cache:
+        prefetch_pkgs = [*BASE_PKGS, *bootloader_packages(uefi)]
+        if args.de:
+            prefetch_pkgs += select_desktop(args.de)[1]
+        prefetch = prefetch_packages(prefetch_pkgs)
+    if prefetch:
+        atexit.register(prefetch.terminate) # Don't leave a download running if we abort early
+
+    disk = select_disk(args.disk)
     unmount_all(disk)
 
-    mode = input("Choose partitioning mode [a]uto/[m]anual: ").strip().lower()
+    mode = args.mode or input("Choose partitioning mode [a]uto/[m]anual: ").strip().lower()
 
-    if mode == 'a':
+    if mode in ('a', 'auto'):
         print(f"\n{Style.WARNING}{Style.BOLD}Auto-partitioning {disk} will erase all data!{Style.ENDC}")
-        if input("Type 'YES' to confirm: ").strip() != 'YES':
+        if not args.yes and input("Type 'YES' to confirm: ").strip() != 'YES':
             print("Aborting.")
             sys.exit(0)
 
-        run_cmd(f"sgdisk -Z {disk}") # Zap GPT table
-        if uefi:
-            # EFI (512M), SWAP (optional), ROOT (rest)
-            run_cmd(f"sgdisk -n 1:0:+512M -t 1:ef00 {disk}") # EFI
-            if input("Create a swap partition? [y/N]: ").lower() == 'y':
-                swap_size = input("Enter swap size (e.g., 4G): ").strip()
-                run_cmd(f"sgdisk -n 2:0:+{swap_size} -t 2:8200 {disk}") # SWAP
-                run_cmd(f"sgdisk -n 3:0:0 -t 3:8300 {disk}") # ROOT
-                swap_part, root_part = part_path(disk, 2), part_path(disk, 3)
-                run_cmd(f"mkswap {swap_part}"); run_cmd(f"swapon {swap_part}")
-            else:
-                run_cmd(f"sgdisk -n 2:0:0 -t 2:8300 {disk}") # ROOT
-                root_part = part_path(disk, 2)
-            
-            efi_part = part_path(disk, 1)
-            run_cmd(f"mkfs.vfat -F32 {efi_part}")
-            run_cmd(f"mkfs.ext4 {root_part}")
-            run_cmd(f"mount {root_part} /mnt")
-            run_cmd("mkdir -p /mnt/boot/efi")
-            run_cmd(f"mount {efi_part} /mnt/boot/efi")
-        else: # BIOS / Legacy (relevant for x86_64, but generic for partitioning)
-            # BOOT (1M bios_boot), SWAP (optional), ROOT (rest)
-            run_cmd(f"sgdisk -n 1:0:+1M -t 1:ef02 {disk}") # BIOS Boot
-            if input("Create a swap partition? [y/N]: ").lower() == 'y':
-                swap_size = input("Enter swap size (e.g., 4G): ").strip()
-                run_cmd(f"sgdisk -n 2:0:+{swap_size} -t 2:8200 {disk}") # SWAP
-                run_cmd(f"sgdisk -n 3:0:0 -t 3:8300 {disk}") # ROOT
-                swap_part, root_part = part_path(disk, 2), part_path(disk, 3)
-                run_cmd(f"mkswap {swap_part}"); run_cmd(f"swapon {swap_part}")
-            else:
-                run_cmd(f"sgdisk -n 2:0:0 -t 2:8300 {disk}") # ROOT
-                root_part = part_path(disk, 2)
-            
-            run_cmd(f"mkfs.ext4 {root_part}")
-            run_cmd(f"mount {root_part} /mnt")
-        
-        run_cmd(f"partprobe {disk}")
+        if args.swap_size or args.no_swap:
+            swap_size = args.swap_size
+        elif input("Create a swap partition? [y/N]: ").lower() == 'y':
+            swap_size = prompt_valid("Enter swap size (e.g., 4G): ", SWAP_SIZE_RE.fullmatch,
+                                     "Swap size must be a whole number followed by K, M, G or T.")
+        else:
+            swap_size = None
+
+        efi_part, root_part, swap_part = auto_partition_disk(disk, uefi, swap_size)
+        format_auto_partitions(root_part, efi_part=efi_part, swap_part=swap_part)
         print(f"{Style.OKGREEN}Auto-partitioning complete.{Style.ENDC}")
     else:
-        manual_partition_and_mount(disk)
+        swap_part = manual_partition_and_mount(disk, uefi)
 
     # --- Installation and Configuration ---
     setup_repos() # Setup repos before installing base
-    install_base_system()
-    install_desktop_and_sound() # Call this before chroot config to enable correct services
+    # Collect every package up front so xbps syncs and resolves only once,
+    # fetching the repository index in the background while the user answers
+    # and scanning the PCI bus for GPUs (the result is cached for detect_graphics_packages)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+        index_sync = pool.submit(sync_repo_index)
+        gpu_scan = pool.submit(detect_gpu_vendors)
+        de_entry, de_pkgs = select_desktop(args.de) # Chosen before chroot config to enable correct services
+        gpu_scan.result()
+        # Install graphics drivers on bare-metal only (skip in VMs)
+        gfx_pkgs = detect_graphics_packages(is_vm)
+        index_synced = index_sync.result()
+    if prefetch:
+        print(f"{Style.OKCYAN}Waiting for base package download to finish...{Style.ENDC}")
+        # Only a run that actually fetched the index (-S) may renew the marker
+        if prefetch.wait() == 0 and "-Sy" in prefetch.args:
+            mark_prefetch_index_synced()
+    all_pkgs = [*BASE_PKGS, *de_pkgs, *gfx_pkgs, *microcode_packages(is_vm), *bootloader_packages(uefi)]
+    if index_synced:
+        fetch_packages_parallel(all_pkgs, cache_dir) # Needs the synced index for its dry run
+    install_packages(all_pkgs, sync=not index_synced, cache_dir=cache_dir)
+    write_fstab(swap_part) # Before chroot config, so the initramfs build sees the final layout
     mount_chroot_dirs()
-    # Install graphics drivers on bare-metal only (skip in VMs)
-    detect_and_install_graphics(is_vm)
-    chroot_and_configure()
+    chroot_and_configure(de_entry, args)
     install_bootloader(disk, uefi, args.force_removable, is_vm)
     umount_chroot_dirs()
 
     print(f"\n{Style.OKGREEN}{Style.BOLD}Installation is complete!{Style.ENDC}")
     print("You can now reboot your system. Don't forget to remove the installation media.")
-    if input("Reboot now? [y/N]: ").lower() == 'y':
-        run_cmd("reboot")
+    if args.reboot or input("Reboot now? [y/N]: ").lower() == 'y':
+        run_cmd(["reboot"])
 
 if __name__ == "__main__":
     main()